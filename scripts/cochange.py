@@ -0,0 +1,155 @@
+import sqlite3
+from pathlib import Path
+from typing import NamedTuple
+
+import click
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+
+from csr import Labels, find_row, load_arrays, save_arrays, to_csr
+
+SELECT_CHANGES = """
+    SELECT DISTINCT commit_id, simple_id AS item
+    FROM changes
+    WHERE commit_id IS NOT NULL AND simple_id IS NOT NULL
+"""
+
+SELECT_FILE_CHANGES = """
+    SELECT DISTINCT C.commit_id, F.filename AS item
+    FROM changes C
+    JOIN filenames F ON F.simple_id = C.simple_id
+    WHERE C.commit_id IS NOT NULL AND F.filename IS NOT NULL
+"""
+
+ARRAYS = ["indptr", "indices", "data", "commits"]
+
+# Upper bound on the number of pairs materialized at once.
+MAX_PAIRS = 1 << 22
+
+
+class CoChange(NamedTuple):
+    """
+    A symmetric co-change count matrix in CSR form.
+
+    Row `i` corresponds to `ids[i]`, and `ids` is sorted. `commits[i]` is the
+    number of (non-skipped) commits that changed `ids[i]`. The diagonal is not
+    stored.
+    """
+
+    indptr: np.ndarray
+    indices: np.ndarray
+    data: np.ndarray
+    ids: Labels
+    commits: np.ndarray
+
+
+def build_cochange(df: pd.DataFrame, *, max_commit_size: int) -> CoChange:
+    commit_codes, _ = pd.factorize(df["commit_id"])
+    item_codes, labels = pd.factorize(df["item"], sort=True)
+    n = len(labels)
+
+    order = np.argsort(commit_codes, kind="stable")
+    item_codes = item_codes[order]
+    sizes = np.bincount(commit_codes)
+    starts = np.cumsum(sizes) - sizes
+
+    kept = np.repeat(sizes <= max_commit_size, sizes)
+    commits = np.bincount(item_codes[kept], minlength=n)
+
+    # Commits of equal size are handled together so that every pair within a
+    # commit can be generated by broadcasting.
+    rows, cols, counts = [], [], []
+    for size in np.unique(sizes):
+        if size < 2 or size > max_commit_size:
+            continue
+        off_diagonal = ~np.eye(size, dtype=bool)
+        group_starts = starts[sizes == size]
+        batch_size = max(1, MAX_PAIRS // (size * size))
+        for i in range(0, len(group_starts), batch_size):
+            batch = group_starts[i : i + batch_size]
+            members = item_codes[batch[:, None] + np.arange(size)]
+            shape = (len(batch), size, size)
+            src = np.broadcast_to(members[:, :, None], shape)[:, off_diagonal]
+            tgt = np.broadcast_to(members[:, None, :], shape)[:, off_diagonal]
+            indptr, indices, data = to_csr(src.ravel(), tgt.ravel(), n)
+            rows.append(np.repeat(np.arange(n), np.diff(indptr)))
+            cols.append(indices)
+            counts.append(data)
+
+    if rows:
+        rows, cols, counts = map(np.concatenate, (rows, cols, counts))
+        indptr, indices, data = to_csr(rows, cols, n, weights=counts)
+    else:
+        indptr, indices, data = to_csr([], [], n)
+    ids = Labels.from_values(labels.tolist())
+    return CoChange(indptr, indices, data, ids, commits.astype(np.int32))
+
+
+def save_cochange(path: Path, matrix: CoChange):
+    arrays = matrix._asdict()
+    arrays.pop("ids").save(path, "ids")
+    save_arrays(path, **arrays)
+
+
+def load_cochange(path: Path, *, mmap: bool = True) -> CoChange:
+    ids = Labels.load(path, "ids", mmap=mmap)
+    return CoChange(ids=ids, **load_arrays(path, *ARRAYS, mmap=mmap))
+
+
+def top_k(matrix: CoChange, id, k: int = 10) -> list[tuple]:
+    """Return up to `k` `(id, count)` pairs that most often change with `id`."""
+    i = find_row(matrix.ids, id)
+    start, end = matrix.indptr[i], matrix.indptr[i + 1]
+    data = np.asarray(matrix.data[start:end])
+    best = np.argsort(-data, kind="stable")[:k]
+    partners = matrix.indices[start:end][best]
+    return [(matrix.ids[j], int(c)) for j, c in zip(partners, data[best])]
+
+
+def process_db(db_path: Path, *, max_commit_size: int, files: bool):
+    jobs = [(db_path.with_suffix(".cochange"), SELECT_CHANGES)]
+    if files:
+        jobs.append((db_path.with_suffix(".cochange-files"), SELECT_FILE_CHANGES))
+    with sqlite3.connect(db_path) as conn:
+        for output_path, sql in jobs:
+            if output_path.exists():
+                print(f"Skipped {output_path}")
+                continue
+            df = pd.read_sql(sql, conn)
+            matrix = build_cochange(df, max_commit_size=max_commit_size)
+            save_cochange(output_path, matrix)
+
+
+@click.command()
+@click.option("--input", required=True, help="A text file of paths to dbs")
+@click.option(
+    "--max-commit-size",
+    default=100,
+    help="Skip commits that change more than this many entities (or files)",
+)
+@click.option("--files", is_flag=True, help="Also roll up to the file level")
+def main(input: str, max_commit_size: int, files: bool):
+    """
+    Build a sparse co-change matrix for each db.
+
+    The matrix counts how many commits change each pair of entities together.
+    It is saved as a directory of memory-mappable arrays next to the db (e.g.
+    `foo.cochange/` for `foo.db`). With `--files`, a second matrix keyed by
+    filename is saved to `foo.cochange-files/`. This requires the filenames
+    table from `augment_dbs.py`.
+    """
+    dbs_file = Path(input).resolve()
+    dbs_root = dbs_file.parent
+    for db_path in tqdm(dbs_file.read_text().splitlines()):
+        db_path = Path(dbs_root, db_path)
+        try:
+            process_db(db_path, max_commit_size=max_commit_size, files=files)
+        except (sqlite3.OperationalError, pd.errors.DatabaseError) as e:
+            print(f"Failed on {db_path}")
+            print(e)
+            print()
+
+
+if __name__ == "__main__":
+    main()
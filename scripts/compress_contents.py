@@ -0,0 +1,240 @@
+import sqlite3
+import time
+import zlib
+from collections import Counter
+from pathlib import Path
+
+import click
+from tqdm import tqdm
+
+# zlib can only look back 32 KiB, so any dictionary larger than this is wasted.
+ZDICT_SIZE = 32 * 1024
+
+COMPRESSED_TABLE = "contents_zlib"
+META_TABLE = "contents_zlib_meta"
+
+# Random rowids are picked first so that the sort does not carry the content.
+SELECT_SAMPLE_ROWIDS = "SELECT rowid FROM contents ORDER BY RANDOM() LIMIT ?"
+
+SELECT_SAMPLE = "SELECT content FROM contents WHERE rowid = ? AND content IS NOT NULL"
+
+SELECT_SCAN = "SELECT content FROM contents"
+
+SELECT_INDEXES = """
+    SELECT sql
+    FROM sqlite_master
+    WHERE type = 'index' AND tbl_name = 'contents' AND sql IS NOT NULL
+"""
+
+
+def train_zdict(samples: list[str], *, size: int = ZDICT_SIZE) -> bytes:
+    """
+    Build a zlib preset dictionary from a sample of file contents.
+
+    Lines that recur across many files (license headers, imports, boilerplate)
+    are the best candidates. zlib finds matches closer to the end of the
+    dictionary more cheaply, so the most common lines are placed last.
+    """
+    counts = Counter()
+    for sample in samples:
+        counts.update(set(sample.splitlines(keepends=True)))
+    common = [(n, line) for line, n in counts.items() if n > 1 and line.strip()]
+    common.sort(key=lambda x: x[0] * len(x[1]), reverse=True)
+    chosen = []
+    total = 0
+    for _, line in common:
+        encoded = line.encode()
+        if total + len(encoded) > size:
+            continue
+        chosen.append(encoded)
+        total += len(encoded)
+    return b"".join(reversed(chosen))
+
+
+def is_compressed(conn: sqlite3.Connection) -> bool:
+    sql = "SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name = ?"
+    return conn.execute(sql, (COMPRESSED_TABLE,)).fetchone()[0] == 1
+
+
+def register_functions(conn: sqlite3.Connection, zdict: bytes):
+    def compress(content):
+        if content is None:
+            return None
+        compressor = zlib.compressobj(level=9, zdict=zdict)
+        return compressor.compress(content.encode()) + compressor.flush()
+
+    def decompress(blob):
+        if blob is None:
+            return None
+        return zlib.decompressobj(zdict=zdict).decompress(blob).decode()
+
+    conn.create_function("zlib_compress", 1, compress, deterministic=True)
+    conn.create_function("zlib_decompress", 1, decompress, deterministic=True)
+
+
+def connect(db_path) -> sqlite3.Connection:
+    """
+    Open a db such that the `contents` view of a compressed db can be queried.
+
+    This is a drop-in replacement for `sqlite3.connect`. Uncompressed dbs are
+    returned untouched.
+    """
+    conn = sqlite3.connect(db_path)
+    if is_compressed(conn):
+        zdict = conn.execute(f"SELECT zdict FROM {META_TABLE}").fetchone()[0]
+        register_functions(conn, zdict)
+    return conn
+
+
+def column_names(conn: sqlite3.Connection, table: str) -> list[str]:
+    return [r[1] for r in conn.execute(f"PRAGMA table_info({table})")]
+
+
+def compress_db(conn: sqlite3.Connection, *, sample_size: int):
+    schema = conn.execute(
+        "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'contents'"
+    ).fetchone()[0]
+    # Dropping the table drops its indexes too, so they are kept for reversal.
+    indexes = ";\n".join(r[0] for r in conn.execute(SELECT_INDEXES))
+    rowids = conn.execute(SELECT_SAMPLE_ROWIDS, (sample_size,)).fetchall()
+    samples = []
+    for rowid in rowids:
+        samples.extend(r[0] for r in conn.execute(SELECT_SAMPLE, rowid))
+    zdict = train_zdict(samples)
+    register_functions(conn, zdict)
+
+    # Only the type of the content column changes. The key is declared at the
+    # table level so that composite keys are kept intact.
+    columns = []
+    keys = []
+    for _, name, kind, notnull, default, pk in conn.execute(
+        "PRAGMA table_info(contents)"
+    ):
+        kind = "BLOB" if name == "content" else kind
+        column = f"{name} {kind}"
+        if notnull:
+            column += " NOT NULL"
+        if default is not None:
+            column += f" DEFAULT {default}"
+        columns.append(column)
+        if pk:
+            keys.append((pk, name))
+    if keys:
+        columns.append(f"PRIMARY KEY ({', '.join(n for _, n in sorted(keys))})")
+    names = column_names(conn, "contents")
+    plain = ", ".join(names)
+    packed = ", ".join(
+        "zlib_compress(content)" if n == "content" else n for n in names
+    )
+    unpacked = ", ".join(
+        "zlib_decompress(content) AS content" if n == "content" else n for n in names
+    )
+
+    quoted_schema = schema.replace("'", "''")
+    quoted_indexes = indexes.replace("'", "''")
+
+    conn.executescript(
+        f"""
+        BEGIN;
+        CREATE TABLE {META_TABLE} (zdict BLOB, schema TEXT, indexes TEXT);
+        INSERT INTO {META_TABLE}
+        VALUES (X'{zdict.hex()}', '{quoted_schema}', '{quoted_indexes}');
+        CREATE TABLE {COMPRESSED_TABLE} ({", ".join(columns)});
+        INSERT INTO {COMPRESSED_TABLE} ({plain}) SELECT {packed} FROM contents;
+        DROP TABLE contents;
+        CREATE VIEW contents AS SELECT {unpacked} FROM {COMPRESSED_TABLE};
+        COMMIT;
+        """
+    )
+
+
+def decompress_db(conn: sqlite3.Connection):
+    schema, indexes = conn.execute(
+        f"SELECT schema, indexes FROM {META_TABLE}"
+    ).fetchone()
+    names = column_names(conn, COMPRESSED_TABLE)
+    plain = ", ".join(names)
+    unpacked = ", ".join(
+        "zlib_decompress(content)" if n == "content" else n for n in names
+    )
+
+    conn.executescript(
+        f"""
+        BEGIN;
+        DROP VIEW contents;
+        {schema};
+        INSERT INTO contents ({plain}) SELECT {unpacked} FROM {COMPRESSED_TABLE};
+        {indexes};
+        DROP TABLE {COMPRESSED_TABLE};
+        DROP TABLE {META_TABLE};
+        COMMIT;
+        """
+    )
+
+
+def used_bytes(conn: sqlite3.Connection) -> int:
+    """Return the size of the db excluding free pages that VACUUM would reclaim."""
+    page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+    freelist_count = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+    return (page_count - freelist_count) * page_size
+
+
+def time_scan(conn: sqlite3.Connection) -> float:
+    start = time.perf_counter()
+    for _ in conn.execute(SELECT_SCAN):
+        pass
+    return time.perf_counter() - start
+
+
+def process_db(db_path: Path, *, reverse: bool, sample_size: int):
+    with connect(db_path) as conn:
+        if is_compressed(conn) != reverse:
+            print(f"Skipped {db_path}")
+            return
+        size_before = used_bytes(conn)
+        scan_before = time_scan(conn)
+        if reverse:
+            decompress_db(conn)
+        else:
+            compress_db(conn, sample_size=sample_size)
+        conn.execute("VACUUM")
+    with connect(db_path) as conn:
+        scan_after = time_scan(conn)
+        size_after = used_bytes(conn)
+    ratio = size_after / size_before
+    print(
+        f"{db_path}: {size_before:,} -> {size_after:,} bytes ({ratio:.1%}), "
+        f"scan {scan_before:.2f}s -> {scan_after:.2f}s"
+    )
+
+
+@click.command()
+@click.option("--input", required=True, help="A text file of paths to dbs")
+@click.option("--reverse", is_flag=True, help="Restore the original contents table")
+@click.option("--sample-size", default=512, help="Number of contents to train on")
+def main(input: str, reverse: bool, sample_size: int):
+    """
+    Compress (or decompress) the contents table of each db in place.
+
+    The contents table is replaced by a view of the same name that decompresses
+    on the fly. Because the view depends on a custom SQLite function, compressed
+    dbs must be opened with `connect` from this module (`export_db_list.py` and
+    `insert_locs.py` already do). Run this after `insert_locs.py`, as the view
+    cannot be altered. Other tools can open compressed dbs with
+    `sqlite3.connect`, but any query that reads the contents view will fail.
+    """
+    dbs_file = Path(input).resolve()
+    dbs_root = dbs_file.parent
+    for db_path in tqdm(dbs_file.read_text().splitlines()):
+        db_path = Path(dbs_root, db_path)
+        try:
+            process_db(db_path, reverse=reverse, sample_size=sample_size)
+        except sqlite3.OperationalError as e:
+            print(f"Failed on {db_path}")
+            print(e)
+            print()
+
+
+if __name__ == "__main__":
+    main()
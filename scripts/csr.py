@@ -0,0 +1,121 @@
+"""
+Helpers for storing sparse matrices in CSR form as a directory of `.npy` files.
+
+Each array is saved separately so that it can be memory-mapped on load without
+reading the whole matrix into memory.
+"""
+
+from bisect import bisect_left
+from pathlib import Path
+
+import numpy as np
+
+LABEL_TYPES = {"int": (int, np.integer), "str": str, "bytes": bytes}
+
+
+def to_csr(rows, cols, n: int, weights=None):
+    """
+    Build the `(indptr, indices, data)` arrays of an `n` by `n` matrix.
+
+    Duplicate `(row, col)` pairs are summed. Without `weights`, each pair counts
+    as one.
+    """
+    keys = np.asarray(rows, dtype=np.int64) * n + np.asarray(cols, dtype=np.int64)
+    if weights is None:
+        keys, data = np.unique(keys, return_counts=True)
+    else:
+        keys, inverse = np.unique(keys, return_inverse=True)
+        data = np.bincount(inverse, weights=weights, minlength=len(keys))
+    rows, cols = np.divmod(keys, n)
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=n), out=indptr[1:])
+    return indptr, cols.astype(np.int32), data.astype(np.int32)
+
+
+def save_arrays(path: Path, **arrays):
+    path.mkdir(parents=True, exist_ok=True)
+    for name, array in arrays.items():
+        np.save(Path(path, f"{name}.npy"), np.asarray(array), allow_pickle=False)
+
+
+def load_arrays(path: Path, *names: str, mmap: bool = True) -> dict:
+    mmap_mode = "r" if mmap else None
+    return {n: np.load(Path(path, f"{n}.npy"), mmap_mode=mmap_mode) for n in names}
+
+
+class Labels:
+    """
+    A sequence of ids or names stored losslessly as flat arrays.
+
+    Integers are kept in an int64 array. Strings and bytes are concatenated into
+    a single uint8 buffer with an array of offsets, so that nothing is padded to
+    a fixed width or stripped of trailing NUL bytes. All values must be of one
+    of these types, and none may be NULL.
+    """
+
+    def __init__(self, kind: str, values=None, offsets=None, buffer=None):
+        self.kind = kind
+        self.values = values
+        self.offsets = offsets
+        self.buffer = buffer
+
+    @classmethod
+    def from_values(cls, values) -> "Labels":
+        values = list(values)
+        for kind, types in LABEL_TYPES.items():
+            if all(isinstance(v, types) for v in values):
+                break
+        else:
+            found = sorted({type(v).__name__ for v in values})
+            raise TypeError(f"Labels must all be int, str, or bytes, not {found}")
+        if kind == "int":
+            return cls("int", values=np.asarray(values, dtype=np.int64))
+        encoded = [v if kind == "bytes" else v.encode() for v in values]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(v) for v in encoded], out=offsets[1:])
+        buffer = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+        return cls(kind, offsets=offsets, buffer=buffer)
+
+    def __len__(self) -> int:
+        if self.kind == "int":
+            return len(self.values)
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: int):
+        i = int(i)
+        if i < 0 or i >= len(self):
+            raise IndexError(i)
+        if self.kind == "int":
+            return int(self.values[i])
+        value = self.buffer[self.offsets[i] : self.offsets[i + 1]].tobytes()
+        return value if self.kind == "bytes" else value.decode()
+
+    def save(self, path: Path, name: str):
+        if self.kind == "int":
+            arrays = {f"{name}.int": self.values}
+        else:
+            arrays = {
+                f"{name}.offsets": self.offsets,
+                f"{name}.{self.kind}": self.buffer,
+            }
+        save_arrays(path, **arrays)
+
+    @classmethod
+    def load(cls, path: Path, name: str, *, mmap: bool = True) -> "Labels":
+        if Path(path, f"{name}.int.npy").exists():
+            values = load_arrays(path, f"{name}.int", mmap=mmap)[f"{name}.int"]
+            return cls("int", values=values)
+        kind = "bytes" if Path(path, f"{name}.bytes.npy").exists() else "str"
+        arrays = load_arrays(path, f"{name}.offsets", f"{name}.{kind}", mmap=mmap)
+        offsets, buffer = arrays[f"{name}.offsets"], arrays[f"{name}.{kind}"]
+        return cls(kind, offsets=offsets, buffer=buffer)
+
+
+def find_row(ids: Labels, id) -> int:
+    """Find the row of `id` in the sorted `ids`."""
+    if not isinstance(id, LABEL_TYPES[ids.kind]):
+        raise KeyError(id)
+    i = bisect_left(ids, id)
+    if i == len(ids) or ids[i] != id:
+        raise KeyError(id)
+    return i
@@ -5,6 +5,8 @@ import click
 import pandas as pd
 from tqdm import tqdm
 
+from compress_contents import connect
+
 SQL_TEST_1 = "SELECT COUNT(*) > 0 FROM changes;"
 SQL_TEST_2 = "SELECT COUNT(*) > 0 FROM contents;"
 SQL_TEST_3 = "SELECT COUNT(*) > 0 FROM deps;"
@@ -27,7 +29,7 @@ def passes_sql_test(cur, sql_test) -> bool:
 
 def is_valid(db_path: Path) -> bool:
     try:
-        with sqlite3.connect(db_path) as conn:
+        with connect(db_path) as conn:
             cur = conn.cursor()
             return all(passes_sql_test(cur, t) for t in SQL_TESTS)
     except sqlite3.OperationalError:
@@ -0,0 +1,238 @@
+import sqlite3
+from pathlib import Path
+from typing import NamedTuple
+
+import click
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+
+from csr import Labels, load_arrays, save_arrays, to_csr
+
+SELECT_ENTITIES = "SELECT id, name FROM entities ORDER BY id"
+
+SELECT_DEPS = "SELECT src, tgt FROM deps"
+
+SELECT_FILENAMES = "SELECT entity_id, file_id, filename FROM filenames"
+
+ARRAYS = ["indptr", "indices", "data"]
+
+LABELS = ["ids", "names"]
+
+
+class DepGraph(NamedTuple):
+    """
+    A directed dependency graph in CSR form.
+
+    Node `i` corresponds to `ids[i]` (an entity id or file id) and has the name
+    `names[i]`. `data` holds the number of deps behind each edge.
+    """
+
+    indptr: np.ndarray
+    indices: np.ndarray
+    data: np.ndarray
+    ids: Labels
+    names: Labels
+
+
+def build_graphs(conn: sqlite3.Connection) -> tuple[DepGraph, DepGraph]:
+    entities = pd.read_sql(SELECT_ENTITIES, conn)
+    deps = pd.read_sql(SELECT_DEPS, conn)
+    filenames = pd.read_sql(SELECT_FILENAMES, conn)
+
+    entity_index = pd.Index(entities["id"])
+    src = entity_index.get_indexer(deps["src"])
+    tgt = entity_index.get_indexer(deps["tgt"])
+    known = (src >= 0) & (tgt >= 0)
+    src, tgt = src[known], tgt[known]
+    n = len(entity_index)
+    indptr, indices, data = to_csr(src, tgt, n)
+    entity_graph = DepGraph(
+        indptr,
+        indices,
+        data,
+        Labels.from_values(entities["id"].tolist()),
+        Labels.from_values(entities["name"].tolist()),
+    )
+
+    # Every entity belongs to exactly one file, so file edges are just entity
+    # edges relabeled by file. Deps within a single file are dropped.
+    files = filenames.drop_duplicates("file_id").sort_values("file_id")
+    file_index = pd.Index(files["file_id"])
+    file_of = np.full(n, -1, dtype=np.int64)
+    entity_rows = entity_index.get_indexer(filenames["entity_id"])
+    file_rows = file_index.get_indexer(filenames["file_id"])
+    found = entity_rows >= 0
+    file_of[entity_rows[found]] = file_rows[found]
+    file_src, file_tgt = file_of[src], file_of[tgt]
+    keep = (file_src >= 0) & (file_tgt >= 0) & (file_src != file_tgt)
+    indptr, indices, data = to_csr(file_src[keep], file_tgt[keep], len(file_index))
+    file_graph = DepGraph(
+        indptr,
+        indices,
+        data,
+        Labels.from_values(files["file_id"].tolist()),
+        Labels.from_values(files["filename"].tolist()),
+    )
+    return entity_graph, file_graph
+
+
+def save_graph(path: Path, graph: DepGraph):
+    arrays = graph._asdict()
+    for name in LABELS:
+        arrays.pop(name).save(path, name)
+    save_arrays(path, **arrays)
+
+
+def load_graph(path: Path, *, mmap: bool = True) -> DepGraph:
+    labels = {n: Labels.load(path, n, mmap=mmap) for n in LABELS}
+    return DepGraph(**labels, **load_arrays(path, *ARRAYS, mmap=mmap))
+
+
+def edges(graph: DepGraph) -> tuple[np.ndarray, np.ndarray]:
+    n = len(graph.indptr) - 1
+    src = np.repeat(np.arange(n), np.diff(graph.indptr))
+    return src, np.asarray(graph.indices, dtype=np.int64)
+
+
+def fan_out(graph: DepGraph) -> np.ndarray:
+    """Return the number of distinct nodes that each node depends on."""
+    return np.diff(graph.indptr)
+
+
+def fan_in(graph: DepGraph) -> np.ndarray:
+    """Return the number of distinct nodes that depend on each node."""
+    return np.bincount(graph.indices, minlength=len(graph.indptr) - 1)
+
+
+def neighbors(indptr, adjacent, nodes) -> tuple[np.ndarray, np.ndarray]:
+    """Return the `(node, neighbor)` pairs of every node in `nodes`."""
+    counts = indptr[nodes + 1] - indptr[nodes]
+    offsets = np.repeat(indptr[nodes] - (np.cumsum(counts) - counts), counts)
+    return np.repeat(nodes, counts), adjacent[offsets + np.arange(counts.sum())]
+
+
+def group_by(keys, values, n: int) -> tuple[np.ndarray, np.ndarray]:
+    """Return `(indptr, values)` with `values` grouped by `keys` in CSR form."""
+    order = np.argsort(keys, kind="stable")
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(keys, minlength=n), out=indptr[1:])
+    return indptr, values[order]
+
+
+def strongly_connected_components(graph: DepGraph, *, seed: int = 0) -> np.ndarray:
+    """
+    Label each node with a representative node of its component.
+
+    This is the coloring algorithm, which only needs whole-array operations.
+    Each node gets a random priority. Each round first trims nodes without
+    incoming or outgoing edges as singletons. Then the largest priority that can
+    reach a node is propagated forward as its color. A node whose color is its
+    own priority is a root, and its component is everything of the same color
+    that can reach it. Roots and their components are removed and the next
+    round starts.
+
+    Propagation and the backward search only visit nodes whose state changed in
+    the previous step, but each step still has a fixed cost. So a round takes a
+    number of steps proportional to the longest path a color travels, e.g. the
+    length of a long cycle or chain. The random priorities keep the number of
+    rounds small; with a fixed order, a chain of components whose priorities
+    decrease along the chain would yield only one root per round.
+    """
+    n = len(graph.indptr) - 1
+    nodes = np.arange(n)
+    priority = np.random.default_rng(seed).permutation(n)
+    node_of = np.empty(n, dtype=np.int64)
+    node_of[priority] = nodes
+    src, tgt = edges(graph)
+    labels = np.full(n, -1, dtype=np.int64)
+    active = np.ones(n, dtype=bool)
+    while active.any():
+        keep = active[src] & active[tgt]
+        src, tgt = src[keep], tgt[keep]
+
+        proper = src != tgt
+        has_in = np.zeros(n, dtype=bool)
+        has_in[tgt[proper]] = True
+        has_out = np.zeros(n, dtype=bool)
+        has_out[src[proper]] = True
+        trivial = active & ~(has_in & has_out)
+        labels[trivial] = nodes[trivial]
+        active &= ~trivial
+        keep = active[src] & active[tgt]
+        src, tgt = src[keep], tgt[keep]
+        if not active.any():
+            break
+
+        color = np.where(active, priority, -1)
+        out_ptr, out_tgt = group_by(src, tgt, n)
+        frontier = np.flatnonzero(active)
+        while len(frontier) > 0:
+            step_src, step_tgt = neighbors(out_ptr, out_tgt, frontier)
+            step_color = color[step_src]
+            better = step_color > color[step_tgt]
+            np.maximum.at(color, step_tgt[better], step_color[better])
+            frontier = np.unique(step_tgt[better])
+
+        reached = active & (color == priority)
+        same = color[src] == color[tgt]
+        in_ptr, in_src = group_by(tgt[same], src[same], n)
+        frontier = np.flatnonzero(reached)
+        while len(frontier) > 0:
+            _, step_src = neighbors(in_ptr, in_src, frontier)
+            frontier = np.unique(step_src[~reached[step_src]])
+            reached[frontier] = True
+        labels[reached] = node_of[color[reached]]
+        active &= ~reached
+    return labels
+
+
+def cycles(graph: DepGraph) -> list[np.ndarray]:
+    """Return the node indices of each component that contains a cycle."""
+    n = len(graph.indptr) - 1
+    labels = strongly_connected_components(graph)
+    src, tgt = edges(graph)
+    cyclic = np.bincount(labels, minlength=n)[labels] > 1
+    cyclic[src[src == tgt]] = True
+    members = np.flatnonzero(cyclic)
+    members = members[np.argsort(labels[members], kind="stable")]
+    splits = np.flatnonzero(np.diff(labels[members])) + 1
+    return np.split(members, splits) if len(members) > 0 else []
+
+
+def process_db(db_path: Path):
+    entity_path = db_path.with_suffix(".deps")
+    file_path = db_path.with_suffix(".deps-files")
+    if entity_path.exists() and file_path.exists():
+        print(f"Skipped {db_path}")
+        return
+    with sqlite3.connect(db_path) as conn:
+        entity_graph, file_graph = build_graphs(conn)
+    save_graph(entity_path, entity_graph)
+    save_graph(file_path, file_graph)
+
+
+@click.command()
+@click.option("--input", required=True, help="A text file of paths to dbs")
+def main(input: str):
+    """
+    Export the deps of each db as entity-level and file-level graphs.
+
+    Each graph is saved in CSR form as a directory of memory-mappable arrays
+    next to the db (e.g. `foo.deps/` and `foo.deps-files/` for `foo.db`). This
+    requires the filenames table from `augment_dbs.py`.
+    """
+    dbs_file = Path(input).resolve()
+    dbs_root = dbs_file.parent
+    for db_path in tqdm(dbs_file.read_text().splitlines()):
+        db_path = Path(dbs_root, db_path)
+        try:
+            process_db(db_path)
+        except (sqlite3.OperationalError, pd.errors.DatabaseError) as e:
+            print(f"Failed on {db_path}")
+            print(e)
+            print()
+
+
+if __name__ == "__main__":
+    main()
@@ -11,6 +11,8 @@ from rich.progress import Progress
 
 from datetime import datetime
 
+from compress_contents import connect, is_compressed
+
 SELECT_CONTENTS = """
     SELECT E.name AS filename, C.content
     FROM entities E
@@ -91,11 +93,16 @@ def process_db(db_root, db_path):
     print(f"Trying {db_path}... ", end="")
     db_path = Path(db_root, db_path)
     try:
-        with sqlite3.connect(db_path) as conn:
+        with connect(db_path) as conn:
             if is_processed(conn.cursor()):
                 # print(f"[{isotimestamp()}] Skipped\n")
                 print("Skipped")
                 return
+            if is_compressed(conn):
+                print("Failed")
+                print("Contents are compressed. Run compress_contents.py --reverse.")
+                print()
+                return
             scc_df = run_scc(conn.cursor())
             try:
                 conn.execute(ADD_COLUMN_LOC)